@@ -1,4 +1,16 @@
+from functools import lru_cache
+
 from sqlglot import exp
+from sqlglot.dialects.dialect import Dialect
+
+With = exp.With
+Table = exp.Table
+
+# Dialect lookups construct a new tokenizer/parser each time; these are shared
+# instead, as both reset their state at the start of every call
+SQLITE = Dialect.get_or_raise("sqlite")
+TOKENIZER = SQLITE.tokenizer_class(dialect=SQLITE)
+PARSER = SQLITE.parser_class(dialect=SQLITE)
 
 def extract_tables(ast):
     """
@@ -7,11 +19,28 @@ def extract_tables(ast):
     with_bindings = set()
     tables = set()
 
-    for with_node in ast.find_all(exp.With):
-        for with_exp in with_node.expressions:
-            with_bindings.add(with_exp.alias)
-
-    for table in ast.find_all(exp.Table):
-        tables.add(table.name)
+    # A single walk over the tree; neither With nor Table have subclasses, so an
+    # identity check on the type is sufficient
+    for node in ast.walk():
+        node_type = type(node)
+        if node_type is With:
+            for with_exp in node.expressions:
+                with_bindings.add(with_exp.alias)
+        elif node_type is Table:
+            tables.add(node.name)
 
     return tables - with_bindings
+
+@lru_cache(maxsize=128)
+def parse_statements(sql):
+    """
+    Parse SQLite SQL into a tuple of (ast, statement_sql) pairs, one per statement.
+
+    statement_sql is the ast rendered as SQLite SQL; rendering also translates
+    syntax SQLite lacks (i.e. ILIKE, ::), so it is what gets executed.
+
+    Results are cached, since in the repl the same query is often re-run; the
+    returned ASTs must not be mutated.
+    """
+    statements = PARSER.parse(TOKENIZER.tokenize(sql), sql)
+    return tuple((ast, ast.sql(dialect="sqlite") if ast is not None else None) for ast in statements)
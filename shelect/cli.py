@@ -1,10 +1,10 @@
 import argparse
 import signal
 import sys
-from sqlglot import parse
 
 from .output import Output
 from .filesystem import Filesystem
+from .ast_utils import parse_statements
 from .engine import Engine
 from .repl import Repl
 
@@ -38,14 +38,14 @@ def main():
     else:
         for query in args.query:
             try:
-                statements = parse(query, dialect="sqlite")
+                statements = parse_statements(query)
             except Exception as e:
                 print(f"SQL syntax error: {e}", file=sys.stderr)
                 sys.exit(1)
-            for statement in statements:
+            for statement, statement_sql in statements:
                 if statement:
                     try:
-                        engine.run_statement(statement)
+                        engine.run_statement(statement, statement_sql)
                     except Exception as e:
                         print(f"Error running SQL: {e}", file=sys.stderr)
                         sys.exit(1)
@@ -1,104 +1,438 @@
 import csv
 import io
+import itertools
 import json
+import re
 import sqlite3
 import sys
+from operator import itemgetter
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 from .ast_utils import extract_tables
 
+# Number of result rows fetched from sqlite per round trip
+FETCH_BATCH_SIZE = 4096
+
+# Rows inserted per INSERT statement when bulk loading
+INSERT_CHUNK_ROWS = 64
+
+# Older SQLite builds allow at most 999 bound parameters per statement
+MAX_INSERT_VARIABLES = 999
+
+# Number of leading CSV rows / JSON objects used to infer column types
+TYPE_SAMPLE_SIZE = 1000
+
+# Rows whose values are checked against the inferred column types at a time
+TYPE_CHECK_BATCH_SIZE = 4096
+
+# Deliberately strict: no leading zeros (i.e. zip codes), signs, whitespace, or
+# integers too large for 64 bits, so that a value reads back as the same text
+INTEGER_RE = re.compile(r'(?:0|-?[1-9][0-9]{0,17})\Z')
+REAL_RE = re.compile(r'-?(?:0|[1-9][0-9]*)\.[0-9]+\Z')
+
+def is_real_text(val):
+    """
+    Return whether val is a decimal that SQLite stores as REAL and reads back as the same text
+    """
+    # SQLite renders REAL values with 15 significant digits; past that, and for
+    # texts such as '1.50' or '-0.0', the text read back differs
+    if REAL_RE.match(val) is None or val == '-0.0':
+        return False
+    return len(val.lstrip('-').replace('.', '').lstrip('0')) <= 15 and repr(float(val)) == val
+
+def all_integer_text(values):
+    """
+    Return whether every value in a list of CSV values is NULL or an integer that reads back as the same text
+    """
+    try:
+        return all(map(INTEGER_RE.match, values))
+    except TypeError:
+        # Only short rows padded with NULLs have non-string values
+        return all(INTEGER_RE.match(val) for val in values if val is not None)
+
+def all_real_text(values):
+    """
+    Return whether every value in a list of CSV values is NULL or a decimal that reads back as the same text
+    """
+    # A float's repr is the shortest text that reads back as it, so comparing
+    # reprs rules out most other texts in C. Any repr containing an exponent,
+    # inf or nan, or too long to be sure of its digits gets the exact check.
+    try:
+        if list(map(repr, map(float, values))) == values:
+            joined = ''.join(values)
+            if 'e' not in joined and 'n' not in joined and max(map(len, values)) <= 16 and '-0.0' not in values:
+                return True
+    except (TypeError, ValueError):
+        pass
+    return all(is_real_text(val) for val in values if val is not None)
+
+# Checks that every CSV value (or NULL) in a list is stored losslessly in a column of the given type
+CSV_TYPE_CHECKS = {
+    'INTEGER': all_integer_text,
+    'REAL': all_real_text,
+}
+
+def infer_column_type(values):
+    """
+    Given sampled CSV values of a column, return the narrowest SQLite column type that holds them all
+    """
+    values = [val for val in values if val is not None]
+    if not values:
+        return 'TEXT'
+    for col_type, all_fit in CSV_TYPE_CHECKS.items():
+        if all_fit(values):
+            return col_type
+    return 'TEXT'
+
+# Nested JSON arrays/objects are stored as compact JSON text
+NESTED_JSON_TYPES = frozenset((dict, list))
+
+def dumps_json_compact(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+def all_json_integer(values):
+    """
+    Return whether every value in a list of JSON values is null or an integer
+    """
+    # bool is a subclass of int, and is stored by SQLite as 0/1
+    return all(map(isinstance, values, itertools.repeat((int, type(None)))))
+
+def all_json_number(values):
+    """
+    Return whether every value in a list of JSON values is null or a number
+    """
+    return all(map(isinstance, values, itertools.repeat((int, float, type(None)))))
+
+# Checks that every JSON value (or null) in a list is stored losslessly in a column of the given type
+JSON_TYPE_CHECKS = {
+    'INTEGER': all_json_integer,
+    'REAL': all_json_number,
+}
+
+def infer_json_column_type(values):
+    """
+    Given sampled JSON values of a column, return the narrowest SQLite column type that holds them all
+    """
+    # Unlike CSV, JSON values are already typed; strings stay TEXT even if numeric
+    values = [val for val in values if val is not None]
+    if not values:
+        return 'TEXT'
+    for col_type, all_fit in JSON_TYPE_CHECKS.items():
+        if all_fit(values):
+            return col_type
+    return 'TEXT'
+
+def dumps_json(obj):
+    """
+    Serialize obj as JSON indented by 2 spaces
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+    # ensure_ascii=False matches orjson, which writes UTF-8 as-is
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
 class Engine:
     def __init__(self, filesystem, output, output_format):
         self._output = output
         self._filesystem = filesystem
         self.loaded_files = set()
         self.output_format = output_format
-        self.conn = sqlite3.connect(':memory:')
+        # Autocommit mode: transactions around file loads are managed explicitly
+        self.conn = sqlite3.connect(':memory:', isolation_level=None)
+        # The database only lives in memory, so skip journaling and durability work
+        self.conn.execute('PRAGMA journal_mode=MEMORY')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA locking_mode=EXCLUSIVE')
+        # Statements are run through one reused cursor rather than one per execute
+        self._cursor = self.conn.cursor()
+        self._cursor.arraysize = FETCH_BATCH_SIZE
 
-    def create_temp_table(self, table_name, columns):
-        col_defs = ", ".join(f'"{col}" TEXT' for col in columns)
+    def create_temp_table(self, table_name, columns, types=None):
+        if types is None:
+            types = ['TEXT'] * len(columns)
+        col_defs = ", ".join(f'"{col}" {col_type}' for col, col_type in zip(columns, types))
         self.conn.execute(f'CREATE TEMP TABLE "{table_name}" ({col_defs})')
 
-    def insert_rows(self, table_name, columns, rows):
+    def insert_sql(self, table_name, columns, row_count):
+        """
+        Return INSERT SQL for table_name with VALUES placeholders for row_count rows
+        """
         placeholders = ", ".join(["?"] * len(columns))
+        values = ", ".join([f"({placeholders})"] * row_count)
         col_names = ", ".join(f'"{col}"' for col in columns)
-        self.conn.executemany(
-            f'INSERT INTO "{table_name}" ({col_names}) VALUES ({placeholders})',
-            rows
-        )
+        return f'INSERT INTO "{table_name}" ({col_names}) VALUES {values}'
+
+    def retype_temp_table(self, table_name, columns, types):
+        """
+        Recreate table_name with new column types, keeping the rows it holds
+        """
+        self.conn.execute(f'ALTER TABLE "{table_name}" RENAME TO "_shelect_retype"')
+        self.create_temp_table(table_name, columns, types)
+        self.conn.execute(f'INSERT INTO "{table_name}" SELECT * FROM temp."_shelect_retype"')
+        self.conn.execute('DROP TABLE temp."_shelect_retype"')
+
+    def insert_typed_rows(self, table_name, columns, types, rows, type_checks):
+        """
+        Create table_name with the given column types and insert rows into it
+
+        types are inferred from a sample, so every value is checked with
+        type_checks, which maps a column type to whether all of a list of values
+        are stored in it without loss. A column with a value that does not fit
+        is changed to TEXT.
+        """
+        types = list(types)
+        rows = iter(rows)
+        self.create_temp_table(table_name, columns, types)
+        while True:
+            checked = [(itemgetter(i), type_checks[col_type]) for i, col_type in enumerate(types) if col_type in type_checks]
+            if not checked:
+                return self.insert_rows(table_name, columns, rows)
+
+            misfits = []
+
+            def fitting_batches():
+                # Rows are checked a column at a time per batch, which keeps the
+                # per-value loop in C
+                while batch := list(itertools.islice(rows, TYPE_CHECK_BATCH_SIZE)):
+                    if all(all_fit(list(map(getter, batch))) for getter, all_fit in checked):
+                        yield batch
+                        continue
+                    first = min(
+                        next((n for n, val in enumerate(map(getter, batch)) if not all_fit([val])), len(batch))
+                        for getter, all_fit in checked
+                    )
+                    yield batch[:first]
+                    misfits.extend(batch[first:])
+                    return
+
+            self.insert_rows(table_name, columns, itertools.chain.from_iterable(fitting_batches()))
+            if not misfits:
+                return
+
+            # Rows inserted so far passed their checks, so their values convert
+            # back to exactly what was read
+            row = misfits[0]
+            types = [
+                'TEXT' if col_type in type_checks and not type_checks[col_type]([val]) else col_type
+                for col_type, val in zip(types, row)
+            ]
+            self.retype_temp_table(table_name, columns, types)
+            rows = itertools.chain(misfits, rows)
+
+    def insert_rows(self, table_name, columns, rows):
+        # Each statement inserts several rows at once, which amortizes sqlite's
+        # per-statement overhead; leftover rows are inserted one at a time
+        chunk_size = max(1, min(INSERT_CHUNK_ROWS, MAX_INSERT_VARIABLES // len(columns)))
+        rows = iter(rows)
+        tail = []
+
+        def chunks():
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if len(chunk) < chunk_size:
+                    tail.extend(chunk)
+                    return
+                yield list(itertools.chain.from_iterable(chunk))
+
+        if chunk_size > 1:
+            self.conn.executemany(self.insert_sql(table_name, columns, chunk_size), chunks())
+        self.conn.executemany(self.insert_sql(table_name, columns, 1), tail if chunk_size > 1 else rows)
+
+    def load_json_objects(self, table_name, objects):
+        """
+        Given an iterable of JSON objects, create table_name with the first object's keys as columns and insert them all
+        """
+        objects = iter(objects)
+        first = next(objects, None)
+        if not isinstance(first, dict):
+            raise ValueError(f"Expected JSON to be a top-level array of objects.")
+
+        columns = list(first.keys())
+        objects = itertools.chain((first,), objects)
+
+        sample = list(itertools.islice(objects, TYPE_SAMPLE_SIZE))
+        types = [
+            infer_json_column_type([obj.get(col) for obj in sample if isinstance(obj, dict)])
+            for col in columns
+        ]
+
+        # itemgetter builds each row tuple in C; it returns a bare value (not a
+        # tuple) when given a single key
+        getter = itemgetter(*columns)
+        single_column = len(columns) == 1
+
+        def to_rows():
+            for obj in itertools.chain(sample, objects):
+                if not isinstance(obj, dict):
+                    raise ValueError(f"Expected JSON to be a top-level array of objects.")
+                try:
+                    row = getter(obj)
+                except KeyError:
+                    # Some keys are missing from this object; those columns are NULL
+                    row = tuple(obj.get(col) for col in columns)
+                else:
+                    if single_column:
+                        row = (row,)
+                # The type check runs in C; rows without nested values pass as-is
+                if not NESTED_JSON_TYPES.isdisjoint(map(type, row)):
+                    row = tuple(dumps_json_compact(val) if type(val) in NESTED_JSON_TYPES else val for val in row)
+                yield row
+
+        self.insert_typed_rows(table_name, columns, types, to_rows(), JSON_TYPE_CHECKS)
 
     def load_json_from_string(self, table_name, content):
-        data = json.loads(content)
+        data = None
+        if orjson is not None:
+            try:
+                data = orjson.loads(content)
+            except orjson.JSONDecodeError:
+                # orjson is stricter than json (i.e. NaN, Infinity);
+                # let the json module parse or report the error
+                pass
+        if data is None:
+            data = json.loads(content)
 
-        if not isinstance(data, list) or not all(isinstance(obj, dict) for obj in data):
-            raise ValueError(f"Expected stdin JSON to be a top-level array of objects.")
+        if not isinstance(data, list):
+            raise ValueError(f"Expected JSON to be a top-level array of objects.")
 
-        columns = list(data[0].keys())
-        rows = [tuple(row.get(col) for col in columns) for row in data]
+        self.load_json_objects(table_name, data)
 
-        self.create_temp_table(table_name, columns)
-        self.insert_rows(table_name, columns, rows)
+    def load_json_from_file(self, table_name, f):
+        """
+        Given a binary file containing a JSON array, stream its objects into table_name
+        """
+        self.load_json_objects(table_name, ijson.items(f, 'item', use_float=True))
 
-    def load_csv_from_string(self, table_name, content):
-        # csv.Sniffer is bizarrely bad at determining information about the file 
-        #
-        # We use a simple heuristic:
-        # - lineterminator: First line looks like a \r\n? Then \r\n; otherwise \n
-        # - deliminator: Limited to either , or \t
+    def load_csv_from_lines(self, table_name, lines):
+        """
+        Given an iterable of CSV/TSV lines (i.e. a text file), stream them into table_name
+        """
+        # csv.Sniffer is bizarrely bad at determining information about the file,
+        # and runs an *intense* regex to do it
         #
-        # The other dialect fields are guessed by the sniffer given the first line
-        # only, to avoid surprises with the *intense* regex
-        first_line = content.partition('\n')[0]
-        lineterminator = '\r\n' if first_line.endswith('\r') else '\n'
-        dialect = csv.Sniffer().sniff(first_line.strip(), [',', '\t'])
-        dialect.lineterminator = lineterminator
+        # We use a simple heuristic instead: the delimiter is limited to either ,
+        # or \t, whichever appears more often in the first line. Otherwise the
+        # excel dialect is used (double-quoted fields with "" escapes). Line
+        # terminators do not need detecting, the reader accepts both \r\n and \n.
+        lines = iter(lines)
+        first_line = next(lines, '')
+        dialect = csv.excel_tab if first_line.count('\t') > first_line.count(',') else csv.excel
+        lines = itertools.chain((first_line,), lines)
+
+        reader = csv.reader(lines, dialect=dialect)
+
+        columns = next(reader, None)
+        if not columns:
+            raise ValueError(f"Expected CSV to have a header row.")
+        width = len(columns)
 
-        with io.StringIO(content) as f:
-            reader = csv.DictReader(f, dialect=dialect)
+        def to_rows():
+            # Rows are positional lists; only ragged rows need fixing up
+            for row in reader:
+                if len(row) != width:
+                    if not row:
+                        continue
+                    # Short rows are padded with NULLs, long rows are truncated
+                    row = (row + [None] * width)[:width]
+                yield row
 
-            columns = reader.fieldnames
-            self.create_temp_table(table_name, columns)
-            rows = [tuple(row[col] for col in columns) for row in reader]
+        rows = to_rows()
 
-        self.insert_rows(table_name, columns, rows)
+        # Column types are inferred from a leading sample. Values are still bound
+        # as strings and converted by SQLite's type affinity, once checked to
+        # convert losslessly.
+        sample = list(itertools.islice(rows, TYPE_SAMPLE_SIZE))
+        types = [infer_column_type(values) for values in zip(*sample)] if sample else ['TEXT'] * width
 
-    def load_file_table_content(self, table_name, content):
+        # Rows are streamed into executemany while the reader is live
+        self.insert_typed_rows(table_name, columns, types, itertools.chain(sample, rows), CSV_TYPE_CHECKS)
+
+    def load_file_table_from_file(self, table_name, f):
         """
-        Given string content of a file, parse as JSON/CSV and load into table_name
+        Given a text file, parse as JSON/CSV and load into table_name
+
+        Only the leading line is read up front to detect the format; CSV is then
+        streamed from the file. The file does not need to be seekable.
         """
-        stripped = content.lstrip()
+        first_line = f.readline()
+        while first_line and not first_line.strip():
+            first_line = f.readline()
 
+        stripped = first_line.lstrip()
         if stripped.startswith("{") or stripped.startswith("["):
-            return self.load_json_from_string(table_name, content)
+            return self.load_json_from_string(table_name, first_line + f.read())
         else:
-            return self.load_csv_from_string(table_name, content)
+            return self.load_csv_from_lines(table_name, itertools.chain((first_line,), f))
 
     def load_file_table(self, table_name):
+        """
+        Load the file at table_name into a table of the same name
+        """
         path = Path(table_name)
 
         if path == Path('-') or path == Path('stdin'):
-            content = self._filesystem.get_stdin().read()
-            return self.load_file_table_content(table_name, content)
+            return self.load_file_table_from_file(table_name, self._filesystem.get_stdin())
 
-        with self._filesystem.open_file(path) as f:
-            content = f.read()
-            return self.load_file_table_content(table_name, content)
+        # With ijson available, JSON arrays are parsed while streaming from the
+        # file rather than from a fully read string
+        if ijson is not None:
+            with self._filesystem.open_binary_file(path) as f:
+                if f.read(4096).lstrip().startswith(b'['):
+                    f.seek(0)
+                    return self.load_json_from_file(table_name, f)
 
-    def run_statement(self, ast):
-        tables = extract_tables(ast)
+        with self._filesystem.open_file(path) as f:
+            return self.load_file_table_from_file(table_name, f)
 
-        # Load files into temp tables
-        for table_name in tables:
-            if table_name not in self.loaded_files:
+    def load_file_tables(self, table_names):
+        """
+        Load each of table_names from the filesystem within a single transaction
+        """
+        # A user-issued BEGIN may already be open; if so, load within it
+        owns_transaction = not self.conn.in_transaction
+        if owns_transaction:
+            self.conn.execute('BEGIN')
+        try:
+            for table_name in table_names:
                 try:
                     self.load_file_table(table_name)
                 except Exception:
                     raise Exception(f'Error loading table data from {table_name}')
-                self.loaded_files.add(table_name)
+        except Exception:
+            if owns_transaction:
+                self.conn.execute('ROLLBACK')
+            raise
+        if owns_transaction:
+            self.conn.execute('COMMIT')
+        self.loaded_files.update(table_names)
 
-        # Execute rewritten SQL
-        sql_to_execute = ast.sql(dialect="sqlite")
-        cursor = self.conn.execute(sql_to_execute)
+    def run_statement(self, ast, sql=None):
+        """
+        Load the files referenced by ast and execute it
+
+        sql is ast already rendered as SQLite SQL (i.e. by parse_statements);
+        when not provided it is generated from the AST.
+        """
+        tables = extract_tables(ast)
+
+        # Load files into temp tables
+        to_load = [table_name for table_name in tables if table_name not in self.loaded_files]
+        if to_load:
+            self.load_file_tables(to_load)
+
+        sql_to_execute = sql if sql is not None else ast.sql(dialect="sqlite")
+        cursor = self._cursor.execute(sql_to_execute)
 
         # If there is no description, no statement was executed (i.e. a comment was executed)
         if cursor.description:
@@ -110,28 +444,26 @@ class Engine:
         """
         if self.output_format == "csv":
             writer = csv.writer(self._output.get_as_file())
-            headers_written = False
-            for row in cursor:
-                if not headers_written:
-                    headers = [desc[0] for desc in cursor.description]
-                    writer.writerow(headers)
-                    headers_written = True
-                writer.writerow(row)
+            writer.writerow([desc[0] for desc in cursor.description])
+            while batch := cursor.fetchmany():
+                writer.writerows(batch)
+            self._output.flush()
 
         elif self.output_format == "json":
+            # Objects are written as they are fetched rather than collected into
+            # one list; the output matches json.dumps(rows, indent=2)
             headers = [desc[0] for desc in cursor.description]
-            rows = [dict(zip(headers, row)) for row in cursor]
-            self._output.print(json.dumps(rows, indent=2))
+            f = self._output.get_as_file()
+            f.write('[')
+            separator = '\n'
+            while batch := cursor.fetchmany():
+                f.write(separator)
+                f.write(',\n'.join('  ' + dumps_json(dict(zip(headers, row))).replace('\n', '\n  ') for row in batch))
+                separator = ',\n'
+            f.write(']\n' if separator == '\n' else '\n]\n')
+            self._output.flush()
 
         elif self.output_format == "table":
-            headers = [desc[0] for desc in cursor.description]
-            rows = list(cursor)
-
-            col_widths = [len(h) for h in headers]
-            for row in rows:
-                for i, val in enumerate(row):
-                    col_widths[i] = max(col_widths[i], len(str(val)))
-
             def format_val(val):
                 if val is None:
                     return 'NULL'
@@ -141,11 +473,24 @@ class Engine:
                     return 'TRUE'
                 return str(val)
 
+            # Column widths are fixed by the first batch of rows, so that the rest
+            # can be streamed; wider values in later batches are not truncated
+            headers = [desc[0] for desc in cursor.description]
+            rows = [tuple(map(format_val, row)) for row in cursor.fetchmany()]
+
+            # Widths are computed column-wise (headers included) so max/map/len run in C
+            col_widths = [max(map(len, col)) for col in zip(headers, *rows)]
+
+            # A single %-format string pads every cell of a row in one call, which is
+            # cheaper than str.format
+            row_format = " | ".join(f"%-{w}s" for w in col_widths)
+
             def format_row(row):
-                return " | ".join(format_val(val).ljust(col_widths[i]) for i, val in enumerate(row))
+                return row_format % row
 
-            divider = "-+-".join("-" * w for w in col_widths)
-            self._output.print(format_row(headers))
-            self._output.print(divider)
-            for row in rows:
-                self._output.print(format_row(row))
+            lines = [format_row(tuple(headers)), "-+-".join("-" * w for w in col_widths)]
+            lines.extend(format_row(row) for row in rows)
+            # One write per batch rather than one per row
+            self._output.print("\n".join(lines))
+            while batch := cursor.fetchmany():
+                self._output.print("\n".join(format_row(tuple(map(format_val, row))) for row in batch))
@@ -1,8 +1,18 @@
+import io
 import sys
 
+# Large buffers cut down on read() syscalls when parsing big files line by line
+READ_BUFFER_SIZE = 1 << 20
+
 class Filesystem:
-    def get_stdin(self, path):
-        return sys.stdin
+    def get_stdin(self):
+        # closefd=False so that the wrapper being collected does not close stdin
+        raw = io.FileIO(sys.stdin.fileno(), 'r', closefd=False)
+        buffered = io.BufferedReader(raw, buffer_size=READ_BUFFER_SIZE)
+        return io.TextIOWrapper(buffered, encoding='utf-8', newline='')
 
     def open_file(self, path):
-        return open(path, 'r')
+        return open(path, 'r', buffering=READ_BUFFER_SIZE, encoding='utf-8', newline='')
+
+    def open_binary_file(self, path):
+        return open(path, 'rb', buffering=READ_BUFFER_SIZE)
@@ -9,11 +9,20 @@ class FilesystemFake:
     def test_set_file(self, path, contents):
         self._files[path] = contents
 
-    def get_stdin(self, path):
-        return io.StringIO(self._stdin)
+    def test_set_stdin(self, contents):
+        self._stdin = contents
 
-    def open_file(self, path):
+    def get_stdin(self):
+        return io.StringIO(self._stdin, newline='')
+
+    def _get_file(self, path):
         try:
-            return io.StringIO(self._files[path])
+            return self._files[path]
         except KeyError:
-            raise FileNotFoundError(f'No such file or directory: {rep(path)}')
+            raise FileNotFoundError(f'No such file or directory: {repr(path)}')
+
+    def open_file(self, path):
+        return io.StringIO(self._get_file(path), newline='')
+
+    def open_binary_file(self, path):
+        return io.BytesIO(self._get_file(path).encode('utf-8'))
@@ -1,8 +1,27 @@
+import io
 import sys
 
+# Large buffers cut down on write() syscalls when writing big result sets
+WRITE_BUFFER_SIZE = 1 << 20
+
 class Output:
+    def __init__(self):
+        self._file = None
+
     def print(self, msg):
+        self.flush()
         print(msg)
 
     def get_as_file(self):
-        return sys.stdout
+        # Anything already printed must land before what is written to the file
+        sys.stdout.flush()
+        if self._file is None:
+            # closefd=False so that the wrapper being collected does not close stdout
+            raw = io.FileIO(sys.stdout.fileno(), 'w', closefd=False)
+            buffered = io.BufferedWriter(raw, buffer_size=WRITE_BUFFER_SIZE)
+            self._file = io.TextIOWrapper(buffered, encoding=sys.stdout.encoding, errors=sys.stdout.errors, newline='')
+        return self._file
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
@@ -10,5 +10,8 @@ class OutputFake:
     def get_as_file(self):
         return self._buffer
 
+    def flush(self):
+        pass
+
     def test_get_output(self):
         return self._buffer.getvalue()
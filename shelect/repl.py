@@ -1,6 +1,8 @@
 import cmd
 import sys
-from sqlglot import Tokenizer, parse, TokenType
+from sqlglot import TokenType
+
+from .ast_utils import TOKENIZER, parse_statements
 
 class Repl(cmd.Cmd):
     intro = "Type SQL statements ending in ';' or Ctrl+D to exit."
@@ -25,15 +27,22 @@ class Repl(cmd.Cmd):
                 self.intro = ''
 
     def default(self, line):
+        # Blank lines before a statement starts are not part of it
+        if not self.buffer and not line.strip():
+            return
         self.buffer.append(line)
 
-        # Join buffer and tokenize to see if we reached end of statement
-        joined = "\n".join(self.buffer).strip()
-        if not joined:
+        # The statement can only have been completed by this line if it contains a
+        # semicolon, or closes a block comment that followed one. Otherwise there
+        # is no need to re-join and re-tokenize the whole buffer.
+        if ';' not in line and '*/' not in line:
+            self.prompt = self.CONT_PROMPT
             return
 
+        # Join buffer and tokenize to see if we reached end of statement
+        joined = "\n".join(self.buffer).strip()
         try:
-            tokens = Tokenizer().tokenize(joined)
+            tokens = TOKENIZER.tokenize(joined)
         except:
             return
         if not tokens or tokens[-1].token_type != TokenType.SEMICOLON:
@@ -47,15 +56,15 @@ class Repl(cmd.Cmd):
         self.prompt = self.ORIG_PROMPT
 
         try:
-            statements = parse(statement, dialect="sqlite")
+            statements = parse_statements(statement)
         except Exception as e:
             print(f"SQL parse error: {e}", file=sys.stderr)
             return
 
-        for statement in statements:
+        for statement, statement_sql in statements:
             if statement:
                 try:
-                    self.engine.run_statement(statement)
+                    self.engine.run_statement(statement, statement_sql)
                 except Exception as e:
                     print(f"Error running SQL: {e}", file=sys.stderr)
 
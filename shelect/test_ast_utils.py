@@ -1,7 +1,7 @@
 import pytest
 from sqlglot import parse_one
 
-from shelect.ast_utils import extract_tables 
+from shelect.ast_utils import extract_tables, parse_statements
 
 def get_file_tables(sql):
     ast = parse_one(sql, dialect="sqlite")
@@ -47,3 +47,24 @@ def test_syntax_error():
     with pytest.raises(Exception, match=r'Expected table name'):
         parse_one(sql, dialect="sqlite")
 
+def test_parse_statements_renders_sqlite_sql():
+    sql = 'SELECT * FROM "./a.csv" WHERE x ILIKE \'a;b\'; select id::text FROM "./b.csv"'
+    statements = parse_statements(sql)
+    assert [statement_sql for _, statement_sql in statements] == [
+        'SELECT * FROM "./a.csv" WHERE LOWER(x) LIKE LOWER(\'a;b\')',
+        'SELECT CAST(id AS TEXT) FROM "./b.csv"',
+    ]
+    assert [extract_tables(ast) for ast, _ in statements] == [{"./a.csv"}, {"./b.csv"}]
+
+def test_parse_statements_comment_only():
+    statements = parse_statements('-- comment\n;')
+    assert [bool(ast) for ast, _ in statements] == [False, True]
+
+def test_parse_statements_is_cached():
+    sql = 'SELECT * FROM "./cached.csv"'
+    assert parse_statements(sql) is parse_statements(sql)
+
+def test_parse_statements_after_syntax_error():
+    with pytest.raises(Exception, match=r'Expected table name'):
+        parse_statements('SELECT FROM WHERE')
+    assert [sql for _, sql in parse_statements('SELECT 1')] == ['SELECT 1']
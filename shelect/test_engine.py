@@ -2,7 +2,9 @@ import pytest
 from sqlglot import parse, parse_one
 from pathlib import Path
 import json
+import sqlite3
 
+from shelect.ast_utils import parse_statements
 from shelect.engine import Engine 
 from shelect.output_fake import OutputFake 
 from shelect.filesystem_fake import FilesystemFake 
@@ -111,10 +113,10 @@ def test_happypath_read_json_write_json():
     parsed = json.loads(output.test_get_output())
     
     assert parsed == [
-        { 'name': 'foo', 'value': '1', },
-        { 'name': 'bar', 'value': '2', },
+        { 'name': 'foo', 'value': 1, },
+        { 'name': 'bar', 'value': 2, },
         { 'name': 'baz', 'value': None, },
-        { 'name': None, 'value': '4', },
+        { 'name': None, 'value': 4, },
     ]
 
 def test_happypath_join():
@@ -188,3 +190,319 @@ a   | b
 ----+----
 foo | bar
 '''.lstrip() == output.test_get_output()
+
+def test_failed_load_rolls_back_other_tables():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), happypath_csv_input)
+
+    engine = Engine(fs, output, 'table')
+
+    with pytest.raises(Exception, match='Error loading table data from missing'):
+        engine.run_statement(parse_one('SELECT * FROM "./data.csv" JOIN missing USING (name)'))
+
+    assert engine.loaded_files == set()
+
+    engine.run_statement(parse_one('SELECT COUNT(*) AS n FROM "./data.csv"'))
+    assert '''
+n
+-
+4
+'''.lstrip() == output.test_get_output()
+
+def test_json_missing_keys_are_null():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.json'), '[{"a": "1", "b": "2"}, {"a": "3"}]')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT * FROM "./data.json"'))
+
+    assert json.loads(output.test_get_output()) == [
+        { 'a': '1', 'b': '2' },
+        { 'a': '3', 'b': None },
+    ]
+
+def test_json_single_column():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.json'), '[{"a": "1"}, {"a": "2"}]')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT * FROM "./data.json"'))
+
+    assert json.loads(output.test_get_output()) == [{ 'a': '1' }, { 'a': '2' }]
+
+def test_json_numbers():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.json'), '[{"a": 1.5, "b": true}]')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT * FROM "./data.json"'))
+
+    assert json.loads(output.test_get_output()) == [{ 'a': 1.5, 'b': 1 }]
+
+def test_json_not_array_of_objects():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.json'), '[{"a": 1}, 2]')
+
+    engine = Engine(fs, output, 'json')
+    with pytest.raises(Exception, match=r'Error loading table data from \./data\.json'):
+        engine.run_statement(parse_one('SELECT * FROM "./data.json"'))
+
+def test_read_csv_from_stdin():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_stdin(happypath_csv_input)
+
+    engine = Engine(fs, output, 'csv')
+    engine.run_statement(parse_one('SELECT * FROM "-"'))
+
+    assert output.test_get_output() == '''
+name,value\r
+foo,1\r
+bar,2\r
+baz,\r
+,4\r
+'''.lstrip()
+
+def test_read_tsv_with_leading_blank_lines():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.tsv'), '\n\nname\tvalue\r\nfoo\t1\r\nbar\t2\r\n')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT * FROM "./data.tsv"'))
+
+    assert json.loads(output.test_get_output()) == [
+        { 'name': 'foo', 'value': 1 },
+        { 'name': 'bar', 'value': 2 },
+    ]
+
+def test_read_csv_preserves_newlines_in_quoted_fields():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), 'a,b\r\n1,"x\r\ny"\r\n')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT * FROM "./data.csv"'))
+
+    assert json.loads(output.test_get_output()) == [{ 'a': 1, 'b': 'x\r\ny' }]
+
+def test_table_output_with_no_rows():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), happypath_csv_input)
+
+    engine = Engine(fs, output, 'table')
+    engine.run_statement(parse_one('SELECT * FROM "./data.csv" WHERE 0'))
+
+    assert output.test_get_output() == '''
+name | value
+-----+------
+'''.lstrip()
+
+def test_csv_output_with_no_rows_writes_headers():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), happypath_csv_input)
+
+    engine = Engine(fs, output, 'csv')
+    engine.run_statement(parse_one('SELECT * FROM "./data.csv" WHERE 0'))
+
+    assert output.test_get_output() == 'name,value\r\n'
+
+def test_json_output_formatting():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), 'name,value\ncafé,1\n')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT name, CAST(value AS INTEGER) AS value, NULL AS n FROM "./data.csv"'))
+
+    assert output.test_get_output() == '''
+[
+  {
+    "name": "café",
+    "value": 1,
+    "n": null
+  }
+]
+'''.lstrip()
+
+def test_run_statement_translates_syntax():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), happypath_csv_input)
+
+    engine = Engine(fs, output, 'csv')
+    for statement, statement_sql in parse_statements('SELECT name, sum(value), value::text FROM "./data.csv" WHERE name ILIKE \'BAR\' GROUP BY 1'):
+        engine.run_statement(statement, statement_sql)
+
+    assert output.test_get_output() == 'name,SUM(value),CAST(value AS TEXT)\r\nbar,2,2\r\n'
+
+def test_csv_column_types_are_inferred():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), 'i,r,zip,mixed,blank\n1,1.5,02134,1,\n-20,2.0,10001,x,3\n')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT * FROM "./data.csv" ORDER BY i'))
+
+    assert json.loads(output.test_get_output()) == [
+        { 'i': -20, 'r': 2.0, 'zip': '10001', 'mixed': 'x', 'blank': '3' },
+        { 'i': 1, 'r': 1.5, 'zip': '02134', 'mixed': '1', 'blank': '' },
+    ]
+
+def test_csv_column_types_are_checked_after_the_sample():
+    fs = FilesystemFake()
+    output = OutputFake()
+    rows = [f'{i},{i}.5,{i},{i},{i}' for i in range(1, 1501)]
+    rows[1200] = '02134,1.50, 7,1.0,1201'
+    fs.test_set_file(Path('./data.csv'), 'a,b,c,d,e\n' + '\n'.join(rows) + '\n')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('''
+        SELECT a, b, c, d, e, typeof(a) AS ta, typeof(b) AS tb, typeof(c) AS tc, typeof(d) AS td, typeof(e) AS te
+        FROM "./data.csv"
+        WHERE rowid IN (1, 1201)
+    '''))
+
+    assert json.loads(output.test_get_output()) == [
+        { 'a': '1', 'b': '1.5', 'c': '1', 'd': '1', 'e': 1, 'ta': 'text', 'tb': 'text', 'tc': 'text', 'td': 'text', 'te': 'integer' },
+        { 'a': '02134', 'b': '1.50', 'c': ' 7', 'd': '1.0', 'e': 1201, 'ta': 'text', 'tb': 'text', 'tc': 'text', 'td': 'text', 'te': 'integer' },
+    ]
+
+def test_csv_ragged_and_blank_rows():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), 'a,b\nx,y\n\nshort\nlong,row,extra\n')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT * FROM "./data.csv"'))
+
+    assert json.loads(output.test_get_output()) == [
+        { 'a': 'x', 'b': 'y' },
+        { 'a': 'short', 'b': None },
+        { 'a': 'long', 'b': 'row' },
+    ]
+
+def test_csv_single_column():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), 'name\nfoo\n"bar, baz"\n')
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT * FROM "./data.csv"'))
+
+    assert json.loads(output.test_get_output()) == [{ 'name': 'foo' }, { 'name': 'bar, baz' }]
+
+def test_csv_load_spanning_several_insert_chunks():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), 'n,s\n' + ''.join(f'{i},row {i}\n' for i in range(150)))
+
+    engine = Engine(fs, output, 'csv')
+    engine.run_statement(parse_one('SELECT COUNT(*), SUM(n), MAX(s) FROM "./data.csv"'))
+
+    assert output.test_get_output() == 'COUNT(*),SUM(n),MAX(s)\r\n150,11175,row 99\r\n'
+
+def test_csv_load_wide_table():
+    fs = FilesystemFake()
+    output = OutputFake()
+    columns = [f'c{i}' for i in range(1000)]
+    fs.test_set_file(Path('./data.csv'), ','.join(columns) + '\n' + ','.join(columns) + '\n')
+
+    engine = Engine(fs, output, 'csv')
+    engine.run_statement(parse_one('SELECT c0, c999 FROM "./data.csv"'))
+
+    assert output.test_get_output() == 'c0,c999\r\nc0,c999\r\n'
+
+def test_json_output_streams_rows():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), happypath_csv_input)
+
+    engine = Engine(fs, output, 'json')
+    engine.run_statement(parse_one('SELECT name FROM "./data.csv" LIMIT 2'))
+    engine.run_statement(parse_one('SELECT name FROM "./data.csv" WHERE 0'))
+
+    assert output.test_get_output() == '''
+[
+  {
+    "name": "foo"
+  },
+  {
+    "name": "bar"
+  }
+]
+[]
+'''.lstrip()
+
+def test_table_output_across_batches():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.csv'), 'name\na\nbb\nccccccc\n')
+
+    engine = Engine(fs, output, 'table')
+    engine._cursor.arraysize = 2
+    engine.run_statement(parse_one('SELECT * FROM "./data.csv"'))
+
+    # Widths come from the first batch; later wider values are not truncated
+    assert output.test_get_output() == '''
+name
+----
+a   
+bb  
+ccccccc
+'''.lstrip()
+
+def test_json_column_types_are_inferred():
+    content = '[{"i": 1, "r": 1, "s": "1", "b": true, "o": {"x": 1}}, {"i": -2, "r": 2.5, "s": "x", "b": false, "o": null}]'
+    expected = [
+        { 'i': 1, 'r': 1.0, 's': '1', 'b': 1, 'o': '{"x":1}' },
+        { 'i': -2, 'r': 2.5, 's': 'x', 'b': 0, 'o': None },
+    ]
+
+    for table_name in ['./data.json', '-']:
+        fs = FilesystemFake()
+        output = OutputFake()
+        fs.test_set_file(Path('./data.json'), content)
+        fs.test_set_stdin(content)
+
+        engine = Engine(fs, output, 'json')
+        engine.run_statement(parse_one(f'SELECT * FROM "{table_name}" WHERE o IS NULL OR typeof(o) = \'text\''))
+
+        assert json.loads(output.test_get_output()) == expected
+
+def test_json_column_types_are_checked_after_the_sample():
+    content = json.dumps([{ 'n': i, 'r': i + 0.5 } for i in range(1000)] + [{ 'n': '007', 'r': [1] }, { 'n': 5, 'r': 2 }])
+
+    for table_name in ['./data.json', '-']:
+        fs = FilesystemFake()
+        output = OutputFake()
+        fs.test_set_file(Path('./data.json'), content)
+        fs.test_set_stdin(content)
+
+        engine = Engine(fs, output, 'json')
+        engine.run_statement(parse_one(f'SELECT n, r, typeof(n) AS tn, typeof(r) AS tr FROM "{table_name}" WHERE rowid IN (2, 1001, 1002)'))
+
+        assert json.loads(output.test_get_output()) == [
+            { 'n': '1', 'r': '1.5', 'tn': 'text', 'tr': 'text' },
+            { 'n': '007', 'r': '[1]', 'tn': 'text', 'tr': 'text' },
+            { 'n': '5', 'r': '2', 'tn': 'text', 'tr': 'text' },
+        ]
+
+def test_json_nested_values_are_serialized_without_global_adapters():
+    fs = FilesystemFake()
+    output = OutputFake()
+    fs.test_set_file(Path('./data.json'), '[{"a": [1, "x"]}, {"a": {"b": []}}]')
+
+    engine = Engine(fs, output, 'csv')
+    engine.run_statement(parse_one('SELECT a FROM "./data.json"'))
+
+    assert output.test_get_output() == 'a\r\n"[1,""x""]"\r\n"{""b"":[]}"\r\n'
+    assert (list, sqlite3.PrepareProtocol) not in sqlite3.adapters
+    assert (dict, sqlite3.PrepareProtocol) not in sqlite3.adapters
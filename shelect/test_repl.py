@@ -0,0 +1,52 @@
+from shelect.repl import Repl
+
+class RecordingEngine:
+    def __init__(self):
+        self.statements = []
+
+    def run_statement(self, ast, sql=None):
+        self.statements.append(sql)
+
+def test_multiline_statement():
+    engine = RecordingEngine()
+    repl = Repl(engine)
+
+    repl.default('SELECT *')
+    assert repl.prompt == Repl.CONT_PROMPT
+    repl.default('FROM "./data.csv"')
+    assert engine.statements == []
+    repl.default('WHERE x = 1;')
+
+    assert engine.statements == ['SELECT * FROM "./data.csv" WHERE x = 1']
+    assert repl.prompt == Repl.ORIG_PROMPT
+
+def test_semicolon_in_string_does_not_end_statement():
+    engine = RecordingEngine()
+    repl = Repl(engine)
+
+    repl.default("SELECT 'a;")
+    repl.default("b' AS x;")
+
+    assert engine.statements == ["SELECT 'a;\nb' AS x"]
+
+def test_block_comment_after_semicolon():
+    engine = RecordingEngine()
+    repl = Repl(engine)
+
+    repl.default('SELECT 1; /* note')
+    assert engine.statements == []
+    repl.default('*/')
+
+    # The comment attaches to the semicolon, producing a comment-only statement
+    assert engine.statements == ['SELECT 1', '/* note\n*/']
+
+def test_leading_blank_lines_are_ignored():
+    engine = RecordingEngine()
+    repl = Repl(engine)
+
+    repl.default('   ')
+    assert repl.buffer == []
+    assert repl.prompt == Repl.ORIG_PROMPT
+    repl.default('SELECT 1;')
+
+    assert engine.statements == ['SELECT 1']